@@ -306,7 +306,7 @@ def _discover(ctx, timeout):
             if not device_entry is None:
                 filtered_devices.update(dict([device_entry]))
         except RuntimeError as e:
-            _log.debug("Probe failed for " + device + " with error: %s", e)
+            _log.debug('Probe failed for "%s" with error: %s', device.mac_address, e)
             pass
         return 0
 
@@ -445,7 +445,7 @@ def _device_set_holiday(ctx, holiday, start, end, temperature):
 
         device.set_holiday(holiday_index, holiday_data)
         return 0
-    _queue_command(ctx, __device_set_holiday_command, ctx.obj.device, holiday, start, end, temperature)
+    _queue_command(ctx, _device_set_holiday_command, ctx.obj.device, holiday, start, end, temperature)
 
 
 @click.group(
@@ -549,7 +549,7 @@ def _device(ctx, address, pin, pin_file):
             return None
 
     pin = _setup_pin(pin, pin_file)
-    device = cometblue.device.CometBlue(address, ctx.obj.manager, pin)
+    device = ctx.obj.manager.make_device(address, pin)
     ctx.obj.device = device
 
     def _device_connect_command(device):
@@ -615,12 +615,12 @@ def _main(ctx, adapter, poweron, formatter, log_level):
 
     def _main_command(ctx, manager, poweron):
         def _powerdown_adapter_command(manager):
-            _log.debug('Shutting down bluetooth adapter %s' % (manager.adapter_name))
+            _log.debug('Shutting down bluetooth adapter %s', manager.adapter_name)
             manager.is_adapter_powered = False
 
         poweron_mgmt = poweron and not manager.is_adapter_powered
         if poweron_mgmt:
-            _log.debug('Powering on bluetooth adapter %s' % (manager.adapter_name))
+            _log.debug('Powering on bluetooth adapter %s', manager.adapter_name)
             manager.is_adapter_powered = True
             _queue_cleanup(ctx, _powerdown_adapter_command, manager)
 
@@ -858,7 +858,7 @@ class CliThread(threading.Thread):
         self._commands = context.commands
         self._kill_event = kill_event
         if context.device:
-            context.device.aborter = lambda: kill_event.is_set()
+            context.device.aborter = kill_event.is_set
 
     def run(self):
         try:
@@ -869,7 +869,7 @@ class CliThread(threading.Thread):
                 if rv != 0:
                     break
         except Exception as ex:
-            _log.error('Command processing returned exception: ' + str(ex))
+            _log.error('Command processing returned exception: %s', ex)
         self._kill_event.set()
 
 def cli_main(argv):
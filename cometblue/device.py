@@ -5,6 +5,7 @@ import datetime
 import functools
 import itertools
 import logging
+import queue
 import struct
 import uuid as uuid_module
 
@@ -22,6 +23,8 @@ _LCD_TIMER_STRUCT_PACKING = '<BB'
 _DAY_STRUCT_PACKING = '<BBBBBBBB'
 _HOLIDAY_STRUCT_PACKING = '<BBBBBBBBb'
 
+_NOTIFICATIONS_QUEUE_SIZE = 1024
+
 _log = logging.getLogger(__name__)
 
 
@@ -85,7 +88,7 @@ def _encode_status(value):
             continue
 
         if not key in _STATUS_BITMASKS:
-            _log.error('Unknown flag ' + key)
+            _log.error('Unknown flag %s', key)
             continue
 
         status_dword |= _STATUS_BITMASKS[key]
@@ -183,7 +186,7 @@ class _day_period_cmp(object):
         return self == other or self < other
 
     def __ge__(self, other):
-        return self == toher or self > other
+        return self == other or self > other
 
     def __ne__(self, other):
         return not self == other
@@ -313,6 +316,7 @@ def _encode_holiday(holiday):
             _temp_float_to_int(holiday, 'temp'))
 
 
+@functools.lru_cache(maxsize=None)
 def _increase_uuid(uuid_str, n):
     uuid_obj = uuid_module.UUID(uuid_str)
     uuid_fields = list(uuid_obj.fields)
@@ -323,8 +327,18 @@ class CometBlueManager(gatt.DeviceManager):
     def __init__(self, adapter_name):
         super().__init__(adapter_name)
 
-    def make_device(self, mac_address):
-        return CometBlue(mac_address = mac_address, manager = self)
+    def make_device(self, mac_address, pin=None):
+        # reuse the instance already known from discovery instead of building a
+        # second one, which would replace it in the manager and unsubscribe its
+        # D-Bus signals; gatt keys its devices by lowercase address
+        mac_address = mac_address.lower()
+        device = self._devices.get(mac_address)
+        if device is None:
+            return CometBlue(mac_address = mac_address, manager = self, pin = pin)
+
+        if pin is not None:
+            device.pin = pin
+        return device
 
 class CometBlue(gatt.Device):
     SUPPORTED_VALUES = {
@@ -449,7 +463,12 @@ class CometBlue(gatt.Device):
         if characteristics_handle is None:
             raise RuntimeError('Handle for uuid "%s" not found, perhaps sync issue?' % (uuid))
 
+        self._cb_read_errors.pop(uuid, None)
         value = characteristics_handle.read_value()
+        if value is None:
+            # gatt reports the failure through characteristic_read_value_failed
+            raise RuntimeError('Failed to read value "%s" from "%s": %s' % (
+                uuid, self.mac_address, self._cb_read_errors.pop(uuid, None)))
 
         _log.debug('Read value "%s" from "%s": %r',
                    uuid, self.mac_address, value)
@@ -467,24 +486,111 @@ class CometBlue(gatt.Device):
             raise RuntimeError('Invalid table row number')
         return self._cb_read_value(_increase_uuid(uuid, n), decode, pin_required)
 
+    def characteristic_read_value_failed(self, characteristic, error):
+        self._cb_read_errors[characteristic.uuid] = error
+        _log.debug('Value read failed for characteristic "%s" with error "%s"', characteristic.uuid, error)
+
     def characteristic_write_value_succeeded(self, characteristic):
-        _log.debug("write for " + characteristic.uuid + " succeeded")
+        _log.debug('write for %s succeeded', characteristic.uuid)
         self._cb_writes[characteristic.uuid] = True
 
     def characteristic_write_value_failed(self, characteristic, error):
         self._cb_writes[characteristic.uuid] = False
-        _log.error('Value write failed for characteristic "%s" with error "%s"' % (characteristic.uuid, error))
+        _log.error('Value write failed for characteristic "%s" with error "%s"', characteristic.uuid, error)
+
+    def characteristic_value_updated(self, characteristic, value):
+        notifications = self._cb_notifications.get(characteristic.uuid, None)
+        if notifications is None:
+            return
+
+        try:
+            notifications.put_nowait(value)
+        except queue.Full:
+            _log.warning('Notification queue for "%s" on "%s" is full, dropping value',
+                         characteristic.uuid, self.mac_address)
+
+    def characteristic_enable_notifications_failed(self, characteristic, error):
+        self._cb_notifications.pop(characteristic.uuid, None)
+        _log.error('Enabling notifications failed for characteristic "%s" with error "%s"',
+                   characteristic.uuid, error)
+
+    def enable_notifications(self, uuid, enabled=True):
+        if not self.is_connected():
+            raise RuntimeError('Not connected')
+
+        characteristics_handle = self._cb_chars.get(uuid, None)
+        if characteristics_handle is None:
+            raise RuntimeError('Handle for uuid "%s" not found, perhaps sync issue?' % (uuid))
+
+        # buffer bursts of notifications, consumer pulls them via get_notification()
+        if enabled:
+            self._cb_notifications.setdefault(
+                    uuid, queue.Queue(maxsize=_NOTIFICATIONS_QUEUE_SIZE))
+        else:
+            self._cb_notifications.pop(uuid, None)
+        characteristics_handle.enable_notifications(enabled)
+
+    def get_notification(self, uuid, timeout=None):
+        """
+        Returns the next value queued for `uuid` since notifications were enabled.
+
+        BlueZ reports a changed value after ordinary reads as well, so while
+        notifications are enabled, every `get_*()` read of the same uuid is queued
+        here too, just like a notification. The signal arrives on the glib thread,
+        possibly after the read has returned, so the two cannot be told apart;
+        avoid mixing reads and notifications on one characteristic.
+
+        Raises StopIteration on disconnect, abort or when `timeout` (defaults to
+        the completion timeout) expires without a value.
+        """
+        notifications = self._cb_notifications.get(uuid, None)
+        if notifications is None:
+            raise RuntimeError('Notifications not enabled for uuid "%s"' % (uuid))
+
+        # a value already queued is returned even for timeouts below one poll
+        try:
+            return notifications.get_nowait()
+        except queue.Empty:
+            pass
+
+        if timeout is None:
+            timeout = self._cb_complete_timeout
+        iterations_limit = timeout / self._cb_complete_sleep
+        i = 0
+        while i < iterations_limit and not self.aborter():
+            i += 1
+            try:
+                return notifications.get(timeout=self._cb_complete_sleep)
+            except queue.Empty:
+                pass
+
+            if not self.is_connected():
+                raise StopIteration('Device disconnected while waiting for notification')
+
+            # queue dropped by disconnect or failed enable, nothing will arrive
+            if self._cb_notifications.get(uuid, None) is not notifications:
+                raise StopIteration('Notifications disabled while waiting for notification')
+
+        if self.aborter():
+            raise StopIteration('Operation aborted due to external request')
+
+        raise StopIteration('No notification received within timeout')
 
     def _cb_wait_write_result(self, uuid):
+        return self._cb_wait_write_results((uuid, ))
+
+    def _cb_wait_write_results(self, uuids):
         iterations_limit = self._cb_complete_timeout / self._cb_complete_sleep
+        pending = set(uuids)
         i = 0
         while i < iterations_limit and not self.aborter():
             i += 1
             if not self.is_connected():
                 raise StopIteration('Device disconnected while waiting for reply')
 
-            if not self._cb_writes.get(uuid, None) is None:
-                return self._cb_writes[uuid]
+            pending = set(uuid for uuid in pending if self._cb_writes.get(uuid, None) is None)
+            if not pending:
+                return all(self._cb_writes[uuid] for uuid in uuids)
             time.sleep(self._cb_complete_sleep)
 
         if self.aborter():
@@ -499,7 +605,7 @@ class CometBlue(gatt.Device):
             _log.debug('Failed to write pin characteristic')
             raise StopIteration('Failed to write pin to device')
 
-    def _cb_write_value(self, uuid, encode, value):
+    def _cb_write_value(self, uuid, encode, value, wait=True):
         if not self.is_connected():
             raise RuntimeError('Not connected')
 
@@ -527,7 +633,7 @@ class CometBlue(gatt.Device):
         value = encode(value)
         characteristics_handle.write_value(value)
 
-        if not self.blocking:
+        if not (wait and self.blocking):
             _log.debug('Assuming successfull write "%s" to "%s": %r', uuid, self.mac_address, value)
             return
 
@@ -538,10 +644,35 @@ class CometBlue(gatt.Device):
         _log.debug('Write failed for "%s" to "%s": %r', uuid, self.mac_address, value)
 
 
-    def _cb_write_value_n(self, uuid, encode, max_n, n, value):
+    def _cb_write_value_n(self, uuid, encode, max_n, n, value, wait=True):
         if (n < 0) or (n >= max_n):
             raise RuntimeError('Invalid table row number')
-        return self._cb_write_value(_increase_uuid(uuid, n), encode, value)
+        return self._cb_write_value(_increase_uuid(uuid, n), encode, value, wait)
+
+    def _cb_write_values_n(self, uuid, encode, max_n, values):
+        # issue all row writes first and wait for their confirmations at once,
+        # instead of paying one confirmation round-trip per row
+        uuids = []
+        try:
+            for n, value in zip(itertools.count(), values):
+                self._cb_write_value_n(uuid, encode, max_n, n, value, wait=False)
+                uuids.append(_increase_uuid(uuid, n))
+        except Exception:
+            # rows issued so far still have to be confirmed before giving up
+            self._cb_confirm_writes(uuid, uuids)
+            raise
+
+        self._cb_confirm_writes(uuid, uuids)
+
+    def _cb_confirm_writes(self, uuid, uuids):
+        if not self.blocking or not uuids:
+            return
+
+        if self._cb_wait_write_results(uuids):
+            _log.debug('Confirmed write of %u values "%s" to "%s"', len(uuids), uuid, self.mac_address)
+            return
+
+        _log.debug('Write failed for some of %u values "%s" to "%s"', len(uuids), uuid, self.mac_address)
 
     @property
     def blocking(self):
@@ -575,6 +706,8 @@ class CometBlue(gatt.Device):
 
         self._cb_chars = None
         self._cb_writes = {}
+        self._cb_read_errors = {}
+        self._cb_notifications = {}
         self._pin = pin
         # for manual connect + disconnect vs. __enter__ vs. __exit__
         self._enter_nesting = 0
@@ -634,13 +767,19 @@ class CometBlue(gatt.Device):
             + ", " \
             + ("services resolved" if self.is_services_resolved() else "pending service resolution") + "]"
 
-    def enumerate_unhandled_characteristics(self):
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _cb_handled_uuids(cls):
         handled = []
-        for _, simple in self.SUPPORTED_VALUES.items():
+        for _, simple in cls.SUPPORTED_VALUES.items():
             handled.append(simple['uuid'])
-        for _, tabbed in self.SUPPORTED_TABLE_VALUES.items():
+        for _, tabbed in cls.SUPPORTED_TABLE_VALUES.items():
             for i in range(tabbed['num']):
                 handled.append(_increase_uuid(tabbed['uuid'], i))
+        return frozenset(handled)
+
+    def enumerate_unhandled_characteristics(self):
+        handled = self._cb_handled_uuids()
 
         unhandled_characteristics = []
         for characteristics in self._cb_chars.keys():
@@ -667,10 +806,12 @@ class CometBlue(gatt.Device):
             finally:
                 self.blocking = True
 
-        unhandled_characteristics = self.enumerate_unhandled_characteristics()
-        if unhandled_characteristics:
-            _log.info('Unknown characteristics discovered on "%s": %r',
-                self.mac_address, unhandled_characteristics)
+        # only walk the characteristics when somebody is going to see the result
+        if _log.isEnabledFor(logging.INFO):
+            unhandled_characteristics = self.enumerate_unhandled_characteristics()
+            if unhandled_characteristics:
+                _log.info('Unknown characteristics discovered on "%s": %r',
+                    self.mac_address, unhandled_characteristics)
 
 
     def __enter__(self):
@@ -722,6 +863,8 @@ class CometBlue(gatt.Device):
             _log.info('Disconnected from device "%s"', self.mac_address)
             self._cb_chars = None
             self._cb_writes = {}
+            self._cb_read_errors = {}
+            self._cb_notifications = {}
         except:
             _log.error('Failed disconnect from device "%s", considering disconnected anyway', self.mac_address)
 
@@ -754,13 +897,19 @@ class CometBlue(gatt.Device):
 
         return data
 
+    def _cb_write_table(self, val_name, value):
+        val_conf = self.SUPPORTED_TABLE_VALUES[val_name]
+        self._cb_write_values_n(
+                str(val_conf['uuid']),
+                val_conf['encode'],
+                val_conf['num'],
+                value)
+
     def set_days(self, value):
-        for day_n, day in zip(itertools.count(), value):
-            self.set_day(day_n, day)
+        self._cb_write_table('day', value)
 
     def set_holidays(self, value):
-        for holiday_n, holiday in zip(itertools.count(), value):
-            self.set_holiday(holiday_n, holiday)
+        self._cb_write_table('holiday', value)
 
     def restore(self, data):
         _log.info('Restoring values from backup for "%s"...',
@@ -28,7 +28,7 @@ def probe_candidate(_device):
                 return (device.mac_address, str(name))
 
     except RuntimeError as exc:
-        _log.debug('Skipping device "%s" ("%s"), reason: %r' % (name, address, str(exc)))
+        _log.debug('Skipping device "%s" ("%s"), reason: %r', name, address, str(exc))
     return None
 
 